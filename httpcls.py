@@ -9,11 +9,16 @@ class HTTPStatus(enum.Enum):
     NOT_FOUND = 404, "Not Found"
     METHOD_NOT_ALLOWED = 405, "Method Not Allowed"
     REQUEST_TIMEOUT = 408, "Request Timeout"
+    REQUEST_HEADER_FIELDS_TOO_LARGE = 431, "Request Header Fields Too Large"
+
+    def __init__(self, code, message):
+        self.line = f"{code} {message}".encode("ascii")
 
     def __str__(self):
         code, message = self.value
         return f"{code} {message}"
 
 
-HTTPRequest = namedtuple("HTTPRequest", ["method", "target"])
-HTTPResponse = namedtuple("HTTPResponse", ["status", "body", "content_type", "content_length"])
+HTTPRequest = namedtuple("HTTPRequest", ["method", "target", "keep_alive"])
+HTTPResponse = namedtuple("HTTPResponse", ["status", "body", "content_type", "content_length", "keep_alive"])
+CachedFile = namedtuple("CachedFile", ["path", "mtime", "size", "content_type", "body"])
@@ -21,6 +21,16 @@ class HttpServer(unittest.TestCase):
   def tearDown(self):
     self.conn.close()
 
+  def test_dot_segments_in_path(self):
+    """dot segments resolve the same way before and after caching"""
+    statuses = []
+    for url in ("/httptest/nope/../text..txt", "/httptest/text..txt", "/httptest/nope/../text..txt"):
+      self.conn.request("GET", url)
+      r = self.conn.getresponse()
+      data = r.read()
+      statuses.append(int(r.status))
+    self.assertEqual(statuses, [200, 200, 200])
+
   def test_empty_request(self):
     """ Send bad http headers """
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -82,6 +92,17 @@ class HttpServer(unittest.TestCase):
       self.assertEqual(data, "bingo, you found it\n")
 
 
+  def test_file_with_null_byte(self):
+    """null byte in filename"""
+    self.conn.request("GET", "/httptest/%00")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertIn(int(r.status), (400, 404))
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+
   def test_file_with_slash(self):
     """slash after filename"""
     self.conn.request("GET", "/httptest/dir2/page.html/")
@@ -149,6 +170,121 @@ class HttpServer(unittest.TestCase):
       self.assertIn("Wikimedia Foundation, Inc.", data)
 
 
+  def test_keep_alive(self):
+    """persistent connection serves several requests"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    data = r.read()
+    sock = self.conn.sock
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(r.getheader("Connection"), "keep-alive")
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(len(data), 20)
+    self.assertIs(self.conn.sock, sock)
+
+  def test_keep_alive_pipelined(self):
+    """pipelined requests are answered in order"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    request = "GET /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n" \
+              "GET /httptest/dir1/dir12/dir123/deep.txt HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+    if v3:
+      s.sendall(request.encode("ascii"))
+      data = b""
+    else:
+      s.sendall(request)
+      data = ""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+
+    if v3:
+      self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+      self.assertTrue(data.find(b"Page Sample") < data.find(b"bingo, you found it\n"))
+      self.assertTrue(data.endswith(b"bingo, you found it\n"))
+    else:
+      self.assertEqual(data.count("HTTP/1.1 200 OK"), 2)
+      self.assertTrue(data.find("Page Sample") < data.find("bingo, you found it\n"))
+      self.assertTrue(data.endswith("bingo, you found it\n"))
+
+  def test_keep_alive_pipelined_empty_line(self):
+    """empty line between pipelined requests is ignored"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    request = "GET /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n\r\n" \
+              "GET /httptest/dir1/dir12/dir123/deep.txt HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+    if v3:
+      s.sendall(request.encode("ascii"))
+      data = b""
+    else:
+      s.sendall(request)
+      data = ""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+
+    if v3:
+      self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+      self.assertTrue(data.endswith(b"bingo, you found it\n"))
+    else:
+      self.assertEqual(data.count("HTTP/1.1 200 OK"), 2)
+      self.assertTrue(data.endswith("bingo, you found it\n"))
+
+  def test_request_head_too_large(self):
+    """request head without terminator is limited to 64 KiB"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    request = "GET /httptest/dir2/page.html HTTP/1.1\r\nX-Pad: "
+    request += "a" * (64 * 1024 - len(request))
+    if v3:
+      s.sendall(request.encode("ascii"))
+      data = b""
+    else:
+      s.sendall(request)
+      data = ""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+
+    if v3:
+      self.assertTrue(data.startswith(b"HTTP/1.1 431 "))
+    else:
+      self.assertTrue(data.startswith("HTTP/1.1 431 "))
+
+  def test_request_with_body_closes(self):
+    """request body is not taken for the next request"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    request = "GET /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\nContent-Length: 22\r\n\r\n" \
+              "GET /x HTTP/1.1\r\n\r\n"
+    if v3:
+      s.sendall(request.encode("ascii"))
+      data = b""
+    else:
+      s.sendall(request)
+      data = ""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+
+    if v3:
+      self.assertEqual(data.count(b"HTTP/1.1 "), 1)
+      self.assertIn(b"Connection: close", data)
+    else:
+      self.assertEqual(data.count("HTTP/1.1 "), 1)
+      self.assertIn("Connection: close", data)
+
   def test_document_root_escaping(self):
     """document root escaping forbidden"""
     self.conn.request("GET", "/httptest/../../../../../../../../../../../../../etc/passwd")
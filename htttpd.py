@@ -1,22 +1,52 @@
 import argparse
-import threading
+import multiprocessing
+import functools
+import selectors
 import socket
 import logging
+import mmap
 import time
-from datetime import datetime
-from pathlib import Path
+from collections import OrderedDict, deque
 import os
+import re
+import posixpath
+import stat
+import errno
 import urllib.parse
 
-from httpcls import HTTPStatus, HTTPRequest, HTTPResponse
+from httpcls import HTTPStatus, HTTPRequest, HTTPResponse, CachedFile
 
 BIND_ADDRESS = ('localhost', 8080)
 BACKLOG_CONN = 1000
-NUMBER_WORKERS = 5
+KEEP_ALIVE_TIMEOUT = 5
+RECV_CHUNK_SIZE = 8192
+MAX_REQUEST_HEAD_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 65536
+MMAP_MAX_SIZE = 1024 * 1024
+FILE_CACHE_MAX_FILE_SIZE = 64 * 1024
+FILE_CACHE_MAX_SIZE = 16 * 1024 * 1024
+NUMBER_WORKERS = os.cpu_count() or 1  # one event loop process per core
 DOCUMENT_ROOT = "/Users/user/PycharmProjects/otus_server"
 SAFE_DIR = "/httptest"
 
-HTTP_METHODS_ALLOWED = ['GET', 'HEAD']
+HTTP_METHODS_ALLOWED = frozenset({b'GET', b'HEAD'})
+
+HEADERS_TEMPLATE = (
+    b"HTTP/1.1 %b\r\n"
+    b"Date: %b\r\n"
+    b"%b\r\n"
+    b"Content-Length: %d\r\n"
+    b"Server: Otus-Python-HTTP-Server\r\n"
+    b"%b\r\n\r\n"
+)
+
+CONNECTION_HEADER = re.compile(rb"\r\nConnection:[ \t]*([^\r]*)", re.IGNORECASE)
+# request bodies are not read, so a request declaring one can not be followed by another
+BODY_HEADER = re.compile(rb"\r\n(?:Transfer-Encoding:|Content-Length:(?![ \t]*0+[ \t]*\r))", re.IGNORECASE)
+CONNECTION_HEADERS = {
+    True: f"Connection: keep-alive\r\nKeep-Alive: timeout={KEEP_ALIVE_TIMEOUT}".encode("ascii"),
+    False: b"Connection: close",
+}
 
 CONTENT_TYPES_ALLOWED = {
     ".html": "text/html",
@@ -29,18 +59,28 @@ CONTENT_TYPES_ALLOWED = {
     ".swf": "application/x-shockwave-flash",
     ".txt": "text/plain",
 }
+CONTENT_TYPES = {
+    suffix: f"Content-Type: {content_type}".encode("ascii")
+    for suffix, content_type in CONTENT_TYPES_ALLOWED.items()
+}
+ERROR_CONTENT_TYPE = b"Content-Type: text/plain"
 
 logging.basicConfig(
     filename=None,
     level=logging.INFO,
     format='[%(asctime)s] %(levelname).1s %(message)s'
 )
+logger = logging.getLogger(__name__)
+
+_DATE_CACHE = (0, b"")
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
 parser = argparse.ArgumentParser(description="Passing number of workers and document root")
 parser.add_argument(
     "-w",
     dest="number_workers",
-    help="Number of workers. If not specified use default script settings.",
+    help="Number of worker processes. If not specified one worker per CPU core is started.",
 )
 parser.add_argument(
     "-d",
@@ -49,31 +89,299 @@ parser.add_argument(
 )
 
 
-def read_request(conn):
-    """ Read bytes by chunks received from a client.
+class Connection:
+    """State of a client connection kept in the selector's data slot.
+        Incoming bytes are received into a preallocated buffer, outgoing data is
+        queued and written out whenever the socket becomes writable. With keep-alive
+        the same buffer serves all requests of the connection.
+        """
+
+    def __init__(self, selector, sock, address, document_root):
+        self.selector = selector
+        self.sock = sock
+        self.address = address
+        self.document_root = document_root
+        self.events = selectors.EVENT_READ
+        self.last_active = time.monotonic()
+        self.buffer = bytearray(RECV_CHUNK_SIZE)
+        self.received = 0
+        self.scanned = 0
+        self.output = deque()
+        self.corked = False
+        self.closing = False
+        self.eof = False
+
+    def __call__(self, sock, mask):
+        self.last_active = time.monotonic()
+        try:
+            if mask & selectors.EVENT_READ:
+                self.on_read()
+            elif mask & selectors.EVENT_WRITE and self.flush():
+                self.handle_requests()
+        except OSError as e:
+            logger.info(
+                "Connection with %s, %s is broken: %s.", self.address[0], self.address[1], e
+            )
+            self.shutdown()
+        except Exception:
+            # a failing request must not take down the worker with all its connections
+            logger.exception(
+                "Unexpected error on connection with %s, %s.", self.address[0], self.address[1]
+            )
+            self.shutdown()
+
+    def on_read(self):
+        self.received, self.eof = read_request(self.sock, self.buffer, self.received)
+        self.handle_requests()
+
+    def handle_requests(self):
+        """Process complete requests from the buffer one by one.
+            Stops when the buffer has no complete request or a response can not be sent at once.
+            """
+        while not self.closing:
+            # empty lines before a request line are ignored (RFC 9112, section 2.2)
+            start = 0
+            while self.buffer.startswith(b"\r\n", start, self.received):
+                start += 2
+            if start:
+                self.consume(start)
+
+            # the terminator may only be split between the scanned part and the new bytes
+            end = self.buffer.find(b"\r\n\r\n", max(0, self.scanned - 3), self.received)
+            if end == -1:
+                if self.eof:
+                    break
+                if self.received >= MAX_REQUEST_HEAD_SIZE:
+                    send_error(self, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    if not self.flush():
+                        return self.watch(selectors.EVENT_WRITE)
+                    break
+                self.scanned = self.received
+                return self.watch(selectors.EVENT_READ)
+
+            end += 4
+            handle_connection(self, self.address, self.buffer[:end], self.document_root)
+            self.consume(end)
+
+            if not self.flush():
+                return self.watch(selectors.EVENT_WRITE)
+
+        logger.info(
+            "Closing the connection."
+        )
+        self.shutdown()
+
+    def consume(self, size):
+        """Drop processed bytes, keeping pipelined bytes of the next request at the start of the buffer."""
+        left = self.received - size
+        self.buffer[:left] = self.buffer[size:self.received]
+        self.received = left
+        self.scanned = max(0, self.scanned - size)
+
+    def watch(self, events):
+        if events != self.events:
+            self.selector.modify(self.sock, events, self)
+            self.events = events
+
+    def write(self, data):
+        if data:
+            self.output.append(memoryview(data))
+
+    def write_file(self, fd, size):
+        """Queue the file body, the connection takes ownership of the file descriptor."""
+        self.output.append(PendingFile(fd, size))
+        # hold back partial frames so headers and the start of the file share a segment
+        if hasattr(socket, "TCP_CORK") and not self.corked:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            self.corked = True
+
+    def close(self):
+        """Close the connection as soon as the queued response is sent."""
+        self.closing = True
+
+    def flush(self):
+        """Write queued data until the socket buffer is full.
+            Consecutive byte buffers are gathered into a single sendmsg call.
+            :return: True when all queued data has been sent
+            """
+        while self.output:
+            item = self.output[0]
+            if isinstance(item, PendingFile):
+                try:
+                    item.send(self.sock)
+                except BlockingIOError:
+                    return False
+                item.close()
+                self.output.popleft()
+                continue
+
+            buffers = []
+            for item in self.output:
+                if isinstance(item, PendingFile):
+                    break
+                buffers.append(item)
+            try:
+                sent = self.sock.sendmsg(buffers)
+            except BlockingIOError:
+                return False
+            for item in buffers:
+                if sent < len(item):
+                    self.output[0] = item[sent:]
+                    return False
+                sent -= len(item)
+                self.output.popleft()
+
+        if self.corked:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            self.corked = False
+        return True
+
+    def shutdown(self):
+        if self.sock.fileno() == -1:
+            return
+        for item in self.output:
+            if isinstance(item, PendingFile):
+                item.close()
+        self.output.clear()
+        self.selector.unregister(self.sock)
+        self.sock.close()
+
+
+class FileCache:
+    """LRU cache of small static files keyed by url path and bounded by the total size of bodies.
+        Entries are revalidated against the file's mtime and size on every lookup.
+        """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Return cached file unless it has been changed or removed since caching.
+            :param key: url path
+            :return: CachedFile named tuple or None
+            """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            st = None
+        if st is None or st.st_mtime_ns != entry.mtime or st.st_size != entry.size:
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.pop(key)
+        self.entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+FILE_CACHE = FileCache(FILE_CACHE_MAX_SIZE)
+
+
+class PendingFile:
+    """File body waiting to be written to a non-blocking socket.
+        Uses sendfile to keep the payload in kernel space. When sendfile is not
+        supported for the file or platform, files up to MMAP_MAX_SIZE are mmapped
+        to share the page cache and larger ones are read by chunks. Small files
+        never get here, they are served from FILE_CACHE.
+        """
+
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.offset = 0
+        self.remaining = size
+        self.use_sendfile = True
+        self.mapping = None
+        self.body = None
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+
+    def map_body(self):
+        """Prepare the file contents for sending from userspace."""
+        self.use_sendfile = False
+        if self.offset + self.remaining <= MMAP_MAX_SIZE:
+            self.mapping = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            self.body = memoryview(self.mapping)
+
+    def close(self):
+        if self.body is not None:
+            self.body.release()
+        if self.mapping is not None:
+            self.mapping.close()
+        os.close(self.fd)
+
+    def send(self, sock):
+        """Write the rest of the file to the socket.
+            :param sock: non-blocking client socket object
+            :return: None
+            :raise BlockingIOError: when the socket does not accept more data yet
+            :raise OSError: when the file ends before the size announced in Content-Length
+            """
+        while self.remaining > 0:
+            if self.use_sendfile:
+                try:
+                    sent = os.sendfile(sock.fileno(), self.fd, self.offset, self.remaining)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+                    self.map_body()
+                    continue
+            elif self.body is not None:
+                sent = sock.send(self.body[self.offset:self.offset + self.remaining])
+            else:
+                sent = sock.send(os.pread(self.fd, min(FILE_CHUNK_SIZE, self.remaining), self.offset))
+            if sent == 0:
+                # the file has shrunk, the response can not be completed
+                raise OSError(errno.EIO, "File is shorter than its Content-Length")
+            self.offset += sent
+            self.remaining -= sent
+
+
+def read_request(conn, buffer, size):
+    """ Read bytes available on a non-blocking client socket into the connection buffer.
+            A single recv is normally enough to get the whole request head.
             :param conn: client socket object
-            :return: data
+            :param buffer: preallocated bytearray, grown by RECV_CHUNK_SIZE when full,
+                up to MAX_REQUEST_HEAD_SIZE checked by the caller
+            :param size: number of bytes already received into the buffer
+            :return: new size and whether the client has closed the connection
             """
-    request_data = bytearray()
-    headers_end = bytearray(b'\r\n\r\n')
+    if size == len(buffer):
+        buffer.extend(bytes(RECV_CHUNK_SIZE))
 
-    while True:
-        data = conn.recv(1024)
-        request_data += data
-        if headers_end in data or not data:
-            break
+    try:
+        with memoryview(buffer) as view, view[size:] as free:
+            received = conn.recv_into(free)
+    except BlockingIOError:
+        return size, False
+    if not received:
+        return size, True
 
-    return request_data
+    return size + received, False
 
 
 def check_safe_url(safe_dir, target_url):
     """ Checks that url is safe and targeting files within safe directory.
-        :param safe_dir: path to directory with shared files
-        :param target_url: url requested
+        Pure string check, the filesystem is not touched.
+        :param safe_dir: url path of directory with shared files
+        :param target_url: url path requested, normalized with posixpath.normpath
         :return: Boolean
         """
-    match = os.path.abspath(target_url)
-    return safe_dir == os.path.commonpath([safe_dir, match])
+    return target_url == safe_dir or target_url.startswith(safe_dir + "/")
 
 
 def parse_request(conn, data):
@@ -82,36 +390,85 @@ def parse_request(conn, data):
         :return: HTTPRequest named tuple
         """
 
-    request_line = str(data, "iso-8859-1").strip()
-    parsed_data = request_line.split("\r\n")
+    end = data.find(b"\r\n")
+    if end == -1:
+        end = len(data)
 
-    logging.info(
-        f"Parsed request: {parsed_data}."
-    )
-    method, target, version = parsed_data[0].split()
+    # request line is "<method> <target> <version>"
+    method_end = data.find(b" ", 0, end)
+    target_end = data.find(b" ", method_end + 1, end)
+    if method_end <= 0 or target_end == -1:
+        raise ValueError("Malformed request line")
 
-    target = urllib.parse.unquote(target)
+    method = bytes(data[:method_end])
+    target = urllib.parse.unquote(data[method_end + 1:target_end].decode("ascii"))
 
-    return HTTPRequest(method=method, target=target)
+    logger.info(
+        "Parsed request: %s %s.", method, target
+    )
+
+    # HTTP/1.1 connections are persistent unless the client asks to close them
+    match = CONNECTION_HEADER.search(data)
+    options = match.group(1).lower() if match else b""
+    if BODY_HEADER.search(data):
+        keep_alive = False
+    elif data.startswith(b"HTTP/1.0", target_end + 1, end):
+        keep_alive = b"keep-alive" in options
+    else:
+        keep_alive = b"close" not in options
 
+    return HTTPRequest(method=method, target=target, keep_alive=keep_alive)
 
-def send_error(conn, status):
-    now = datetime.now().strftime("%a, %d %b %Y %H:%M:%S GMT")
-    body = str(status).encode("utf-8")
 
-    headers = (
-        f"HTTP/1.1 {status}",
-        f"Date: {now}",
-        f"Content-Type: text/plain",
-        f"Content-Length: {len(body)}",
-        "Server: Otus-Python-HTTP-Server",
-        "Connection: close"
+def open_file(path):
+    """Open a regular file, or the index file of a directory, resolving each path only once.
+        :param path: path to a file or directory
+        :return: path opened, file descriptor and its stat result
+        :raise OSError: when there is no such regular file
+        """
+    # O_NONBLOCK keeps a FIFO from blocking the worker, regular files ignore it
+    flags = os.O_RDONLY | getattr(os, "O_NONBLOCK", 0)
+    fd = os.open(path, flags)
+    st = os.fstat(fd)
+    if stat.S_ISDIR(st.st_mode):
+        os.close(fd)
+        path = os.path.join(path, "index.html")
+        fd = os.open(path, flags)
+        st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        raise OSError(errno.ENOENT, "Not a regular file", path)
+    return path, fd, st
+
+
+def http_date():
+    """Current time formatted for the Date header, recomputed at most once per second.
+        :return: RFC 1123 date in bytes
+        """
+    global _DATE_CACHE
+    now = int(time.time())
+    ts, cached = _DATE_CACHE
+    if now == ts:
+        return cached
+    # day and month names are fixed by RFC 1123, strftime would follow the locale
+    t = time.gmtime(now)
+    date = b"%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        WEEKDAYS[t.tm_wday].encode("ascii"), t.tm_mday, MONTHS[t.tm_mon - 1].encode("ascii"),
+        t.tm_year, t.tm_hour, t.tm_min, t.tm_sec,
     )
+    _DATE_CACHE = (now, date)
+    return date
 
-    raw_response = "\r\n".join(headers).encode("utf-8")
-    raw_response += b"\r\n\r\n" + body
-    conn.sendall(raw_response)
-    conn.close()
+
+def send_error(conn, status, keep_alive=False):
+    body = status.line
+
+    raw_response = HEADERS_TEMPLATE % (
+        status.line, http_date(), ERROR_CONTENT_TYPE, len(body), CONNECTION_HEADERS[keep_alive]
+    ) + body
+    conn.write(raw_response)
+    if not keep_alive:
+        conn.close()
 
 
 def send_response(conn, response):
@@ -120,42 +477,35 @@ def send_response(conn, response):
         :param response: HTTPResponse named tuple
         :return: None
         """
-    now = datetime.now().strftime("%a, %d %b %Y %H:%M:%S GMT")
-
-    headers = (
-        f"HTTP/1.1 {response.status}",
-        f"Date: {now}",
-        f"Content-Type: {response.content_type}",
-        f"Content-Length: {response.content_length}",
-        "Server: Otus-Python-HTTP-Server",
-        "Connection: close"
+    raw_headers = HEADERS_TEMPLATE % (
+        response.status.line,
+        http_date(),
+        response.content_type,
+        response.content_length,
+        CONNECTION_HEADERS[response.keep_alive],
     )
 
-    raw_response = "\r\n".join(headers).encode("utf-8")
-    raw_response += b"\r\n\r\n" + response.body
-
-    logging.info(
-        f"Response is ready to be send."
+    logger.info(
+        "Response is ready to be send."
     )
 
-    conn.sendall(raw_response)
-    logging.info(
-        f"Response has been successfully send."
-    )
+    # headers and body are gathered on sending, without concatenating them here
+    conn.write(raw_headers)
+    conn.write(response.body)
 
 
-def handle_connection(conn, address, document_root):
-    """Process request from a client, prepare and send response in the new thread.
-        :param conn: client socket object
+def handle_connection(conn, address, data, document_root):
+    """Process request from a client, prepare response and queue it for sending.
+        :param conn: Connection object
         :param address: client ip address
+        :param data: request data in bytes
         :param document_root: working public directory
         :return: None
         """
 
-    logging.info(
-        f"Start to process request from {address[0]}, {address[1]}."
+    logger.info(
+        "Start to process request from %s, %s.", address[0], address[1]
     )
-    data = read_request(conn)
 
     try:
         request = parse_request(conn, data)
@@ -167,91 +517,194 @@ def handle_connection(conn, address, document_root):
     if request.method not in HTTP_METHODS_ALLOWED:
         return send_error(conn, HTTPStatus.METHOD_NOT_ALLOWED)
 
-    # checks for directory traversal
-    if not check_safe_url(SAFE_DIR, target):
-        return send_error(conn, HTTPStatus.FORBIDDEN)
+    target = target.partition("?")[0]
 
-    target = target.partition("/")[-1].partition("?")[0]
+    url_path = posixpath.normpath(target)
 
-    path = Path(os.path.join(document_root, target))
+    # checks for directory traversal
+    if not check_safe_url(SAFE_DIR, url_path):
+        return send_error(conn, HTTPStatus.FORBIDDEN, request.keep_alive)
 
-    path = Path(str(path).replace("%20", ' '))
+    # normpath drops a trailing slash, which still makes "file.html/" a 404
+    if target.endswith("/") and url_path != "/":
+        url_path += "/"
 
-    if path.is_dir():
-        path /= "index.html"
-    elif target.endswith("/"):
-        return send_error(conn, HTTPStatus.NOT_FOUND)
+    # the path checked above is the one used as cache key and opened
+    fd = None
+    cached = FILE_CACHE.get(url_path)
+    if cached is None:
+        path = os.path.join(document_root, url_path.lstrip("/"))
 
-    logging.info(
-        f"Target path from the request: {path}."
+        try:
+            path, fd, st = open_file(path)
+        except (OSError, ValueError):
+            # also covers a trailing slash after a file name (ENOTDIR) and a NUL byte in the path
+            return send_error(conn, HTTPStatus.NOT_FOUND, request.keep_alive)
+
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1])
+        if content_type is None:
+            os.close(fd)
+            return send_error(conn, HTTPStatus.FORBIDDEN, request.keep_alive)
+
+        # small files are kept in memory, large ones are sent from the page cache
+        if st.st_size <= FILE_CACHE_MAX_FILE_SIZE:
+            body = os.pread(fd, st.st_size, 0)
+            os.close(fd)
+            fd = None
+            cached = CachedFile(path, st.st_mtime_ns, len(body), content_type, body)
+            FILE_CACHE.put(url_path, cached)
+        else:
+            content_length = st.st_size  # count the length of body
+
+    if cached is not None:
+        path = cached.path
+        content_type = cached.content_type
+        content_length = cached.size
+
+    logger.info(
+        "Target path from the request: %s.", path
     )
 
-    if not path.is_file():
-        return send_error(conn, HTTPStatus.NOT_FOUND)
-
-    stat = path.stat()
-    content_length = stat.st_size  # count the length of body
-    body = b"" if method == "HEAD" else path.read_bytes()
-
     response = HTTPResponse(
         status=HTTPStatus.OK,
-        body=body,
-        content_type=CONTENT_TYPES_ALLOWED[path.suffix],
+        body=cached.body if cached is not None and method != b"HEAD" else b"",
+        content_type=content_type,
         content_length=content_length,
+        keep_alive=request.keep_alive,
     )
 
-    logging.info(
-        f"Prepared response: {HTTPResponse}."
+    logger.info(
+        "Prepared response: %s, %s bytes.", response.status, content_length
     )
 
     send_response(conn, response)
-    conn.close()
-    logging.info(
-        "Closing the connection."
-    )
-
-
-def wait_connection(server, id):
-    """Waiting forever and accepting connection when incoming.
+    if fd is not None:
+        if method != b"HEAD":
+            conn.write_file(fd, content_length)
+        else:
+            os.close(fd)
+    if not response.keep_alive:
+        conn.close()
+
+
+def accept_connection(selector, id, document_root, server, mask):
+    """Accept incoming connection and register it in the worker's selector.
+        :param selector: worker's selector
+        :param id: worker id
+        :param document_root: working public directory
         :param server: listening socket object
-        :param id: thread id
+        :param mask: selector events mask
         :return: None
         """
-    while True:
+    try:
         client_socket, address = server.accept()
-        logging.info(
-            f"Thread-{id} has started to process connection from {address[0]}, {address[1]}."
-        )
-        handle_connection(client_socket, address, DOCUMENT_ROOT)
+    except BlockingIOError:
+        # connection has been already accepted or the client has gone
+        return
+    except OSError as e:
+        logger.warning("Worker-%s can not accept connection: %s.", id, e)
+        if e.errno in (errno.EMFILE, errno.ENFILE):
+            # out of descriptors: free idle ones and stop accepting until the next check,
+            # otherwise the still readable listening socket keeps the loop spinning
+            close_idle_connections(selector)
+            selector.unregister(server)
+        return
+
+    logger.info(
+        "Worker-%s has started to process connection from %s, %s.", id, address[0], address[1]
+    )
+    client_socket.setblocking(False)
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    selector.register(
+        client_socket, selectors.EVENT_READ, Connection(selector, client_socket, address, document_root)
+    )
 
-        logging.info(f"Thread-{id} has been stopped.")
 
+def open_listening_socket():
+    """Open a non-blocking listening TCP socket sharing BIND_ADDRESS with the other workers.
+        With SO_REUSEPORT the kernel keeps a separate accept queue per socket and
+        balances incoming connections between them.
+        :return: listening socket object
+        """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind(BIND_ADDRESS)
+    server.listen(BACKLOG_CONN)
+    server.setblocking(False)
+    return server
+
+
+def close_idle_connections(selector):
+    """Close connections which have had no activity for KEEP_ALIVE_TIMEOUT seconds.
+        :param selector: worker's selector
+        :return: None
+        """
+    deadline = time.monotonic() - KEEP_ALIVE_TIMEOUT
+    for key in list(selector.get_map().values()):
+        if isinstance(key.data, Connection) and key.data.last_active < deadline:
+            logger.info(
+                "Closing idle connection with %s, %s.", key.data.address[0], key.data.address[1]
+            )
+            key.data.shutdown()
 
-def serve_forever(workers_number):
-    """Open a listening TCP socket and creating new pool of threads/workers to wait for a connection .
-        :param workers_number: Number of workers.
+
+def wait_connection(id, document_root):
+    """Run an event loop multiplexing the worker's listening socket and all its client connections.
+        :param id: worker id
+        :param document_root: working public directory
         :return: None
         """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind(BIND_ADDRESS)
-        server.listen(BACKLOG_CONN)
-        logging.info(
-            f"Server is running on http://{BIND_ADDRESS[0]}:{BIND_ADDRESS[1]}/ (Press CTRL+C to quit)"
-        )
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[(id - 1) % len(cpus)]})
 
-        for i in range(1, workers_number + 1):
-            thread = threading.Thread(
-                target=wait_connection, args=(server, i)
-            )
-            thread.start()
+    selector = selectors.DefaultSelector()
+    with open_listening_socket() as server:
+        accept = functools.partial(accept_connection, selector, id, document_root)
+        selector.register(server, selectors.EVENT_READ, accept)
 
         try:
+            last_check = time.monotonic()
             while True:
-                time.sleep(1)
+                for key, mask in selector.select(timeout=1):
+                    key.data(key.fileobj, mask)
+                if time.monotonic() - last_check >= 1:
+                    close_idle_connections(selector)
+                    # resume accepting if it has been paused for lack of descriptors
+                    if server not in selector.get_map():
+                        selector.register(server, selectors.EVENT_READ, accept)
+                    last_check = time.monotonic()
         except KeyboardInterrupt:
-            logging.info("Server is stopping.")
-            return None
+            logger.info("Worker-%s has been stopped.", id)
+
+
+def serve_forever(workers_number, document_root):
+    """Start worker processes, each with its own listening socket and event loop.
+        :param workers_number: Number of workers.
+        :param document_root: working public directory
+        :return: None
+        """
+    workers = [
+        multiprocessing.Process(target=wait_connection, args=(i, document_root))
+        for i in range(1, workers_number + 1)
+    ]
+    for worker in workers:
+        worker.start()
+
+    logger.info(
+        "Server is running on http://%s:%s/ (Press CTRL+C to quit)", BIND_ADDRESS[0], BIND_ADDRESS[1]
+    )
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logger.info("Server is stopping.")
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        return None
 
 
 if __name__ == "__main__":
@@ -261,4 +714,4 @@ if __name__ == "__main__":
     if args.number_workers:
         NUMBER_WORKERS = int(args.number_workers)
 
-    serve_forever(NUMBER_WORKERS)
+    serve_forever(NUMBER_WORKERS, DOCUMENT_ROOT)